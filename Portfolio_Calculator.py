@@ -3,6 +3,8 @@ import pandas as pd
 import plotly.graph_objects as go
 import numpy as np
 
+from monte_carlo import draw_growth_factors, grow_balances
+
 # Page config
 st.set_page_config(page_title="Portfolio Calculator", page_icon="💰", layout="wide")
 
@@ -11,7 +13,9 @@ st.sidebar.markdown("---")
 theme = st.sidebar.radio("🎨 Theme", ["Light", "Dark"], index=0)
 
 # --- CSS Themes ---
-dark_css = """
+@st.cache_resource
+def _themes():
+    dark_css = """
 <style>
     .stApp {
         background: linear-gradient(135deg, #0f0f1a 0%, #1a1a2e 50%, #16213e 100%);
@@ -80,7 +84,7 @@ dark_css = """
 </style>
 """
 
-light_css = """
+    light_css = """
 <style>
     .stApp {
         background: linear-gradient(135deg, #f0f4ff 0%, #ffffff 50%, #f5f9f5 100%);
@@ -150,8 +154,10 @@ light_css = """
 </style>
 """
 
-# Apply selected theme
-st.markdown(dark_css if theme == "Dark" else light_css, unsafe_allow_html=True)
+    return {"Dark": dark_css, "Light": light_css}
+
+# Apply selected theme (must be re-emitted every rerun, or Streamlit drops it)
+st.markdown(_themes()[theme], unsafe_allow_html=True)
 
 # Subtitle color based on theme
 subtitle_color = "#a0a0b0" if theme == "Dark" else "#5f6368"
@@ -160,74 +166,85 @@ st.title("💰 Portfolio Growth Calculator")
 st.markdown(f'<p style="color:{subtitle_color}; font-size:1.1rem; margin-top:-1rem;">Monte Carlo simulation & compound growth analysis</p>', unsafe_allow_html=True)
 
 # --- Inputs (sidebar) ---
-st.sidebar.header("Your Inputs")
-initial_balance = st.sidebar.number_input("Initial Balance ($)", min_value=0.0, value=10000.0, step=1000.0)
-annual_return = st.sidebar.number_input("Expected Annual Return (%)", min_value=0.0, max_value=100.0, value=7.0, step=0.5)
-years = st.sidebar.slider("Number of Years", min_value=1, max_value=50, value=10)
-annual_contribution = st.sidebar.number_input("Annual Contribution ($)", min_value=0.0, value=2000.0, step=500.0)
-
-st.sidebar.divider()
-st.sidebar.header("Monte Carlo Settings")
-volatility = st.sidebar.slider("Annual Volatility / Risk (%)", min_value=1, max_value=40, value=15,
-                                help="Standard deviation of annual returns. S&P 500 is historically ~15%")
-simulations = st.sidebar.slider("Number of Simulations", min_value=100, max_value=2000, value=500, step=100)
-
-# --- Deterministic Calculation (base case) ---
-rate = annual_return / 100
-balance = initial_balance
-total_contributions = 0
-data = []
-
-for year in range(1, years + 1):
-    balance += annual_contribution
-    total_contributions += annual_contribution
-    new_balance = balance * (1 + rate)
-    annual_gain = new_balance - balance
-    total_gain = new_balance - (initial_balance + total_contributions)
+# Inside a form, widget changes only trigger a rerun once "Run Simulation" is pressed
+# The dollar caps keep float32 balances from overflowing to inf even at every other
+# input's maximum (worst case ~1e29 vs. the float32 limit of ~3.4e38)
+with st.sidebar.form("sim_inputs"):
+    st.header("Your Inputs")
+    initial_balance = st.number_input("Initial Balance ($)", min_value=0.0, max_value=1e12, value=10000.0, step=1000.0)
+    annual_return = st.number_input("Expected Annual Return (%)", min_value=0.0, max_value=100.0, value=7.0, step=0.5)
+    years = st.slider("Number of Years", min_value=1, max_value=50, value=10)
+    annual_contribution = st.number_input("Annual Contribution ($)", min_value=0.0, max_value=1e12, value=2000.0, step=500.0)
+
+    st.divider()
+    st.header("Monte Carlo Settings")
+    volatility = st.slider("Annual Volatility / Risk (%)", min_value=1, max_value=40, value=15,
+                           help="Standard deviation of annual returns. S&P 500 is historically ~15%")
+    simulations = st.slider("Number of Simulations", min_value=100, max_value=2000, value=500, step=100)
+
+    st.form_submit_button("Run Simulation", use_container_width=True)
+
+# --- Calculations ---
+# Bounded so free-form inputs can't grow the cache without limit on a shared server
+@st.cache_data(max_entries=32)
+def run_simulation(initial_balance, annual_return, years, annual_contribution, volatility, simulations):
+    """Base case + Monte Carlo, cached on the inputs so e.g. a theme toggle doesn't re-simulate."""
+    # --- Deterministic Calculation (base case) ---
+    # Contributions go in at the start of each year, then the year's return is applied.
+    rate = annual_return / 100
+    year_idx = np.arange(1, years + 1)
+    if rate == 0:
+        balances = initial_balance + annual_contribution * year_idx
+    else:
+        growth_pow = (1 + rate) ** year_idx
+        balances = (initial_balance * growth_pow
+                    + annual_contribution * (1 + rate) * (growth_pow - 1) / rate)
+    total_contributions = annual_contribution * year_idx
     total_invested = initial_balance + total_contributions
-    data.append({
-        "Year": year,
-        "Balance": round(new_balance, 2),
-        "Annual Gain": round(annual_gain, 2),
-        "Total Gain": round(total_gain, 2),
-        "Total Contributed": round(total_contributions, 2),
-        "Initial + Contributions": round(total_invested, 2),
-        "Market Gains": round(total_gain, 2)
+    total_gain = balances - total_invested
+    annual_gain = np.diff(balances, prepend=initial_balance) - annual_contribution
+
+    df = pd.DataFrame({
+        "Year": year_idx,
+        "Balance": np.round(balances, 2),
+        "Annual Gain": np.round(annual_gain, 2),
+        "Total Gain": np.round(total_gain, 2),
+        "Total Contributed": np.round(total_contributions, 2),
+        "Initial + Contributions": np.round(total_invested, 2),
+        "Market Gains": np.round(total_gain, 2),
     })
-    balance = new_balance
-
-total_invested = initial_balance + total_contributions
-df = pd.DataFrame(data)
-
-# --- Monte Carlo Simulation ---
-np.random.seed(42)
-vol = volatility / 100
-all_simulations = []
-
-for _ in range(simulations):
-    sim_balance = initial_balance
-    sim_path = []
-    for year in range(1, years + 1):
-        sim_balance += annual_contribution
-        annual_rate = np.random.normal(rate, vol)
-        sim_balance *= (1 + annual_rate)
-        sim_path.append(max(sim_balance, 0))
-    all_simulations.append(sim_path)
-
-sim_array = np.array(all_simulations)
-
-# Percentiles
-p5  = np.percentile(sim_array,  5, axis=0)
-p10 = np.percentile(sim_array, 10, axis=0)
-p25 = np.percentile(sim_array, 25, axis=0)
-p50 = np.percentile(sim_array, 50, axis=0)
-p75 = np.percentile(sim_array, 75, axis=0)
-p90 = np.percentile(sim_array, 90, axis=0)
-p95 = np.percentile(sim_array, 95, axis=0)
-avg = np.mean(sim_array, axis=0)
-
-year_range = list(range(1, years + 1))
-final_balances = sim_array[:, -1]
+
+    # --- Monte Carlo Simulation ---
+    factors = draw_growth_factors(rate, volatility / 100, years, simulations)
+    sim_array = grow_balances(factors, initial_balance, annual_contribution)
+
+    # Percentiles
+    p5, p10, p25, p50, p75, p90, p95 = np.percentile(sim_array, [5, 10, 25, 50, 75, 90, 95], axis=0)
+    percentiles = {
+        "p5": p5, "p10": p10, "p25": p25, "p50": p50,
+        "p75": p75, "p90": p90, "p95": p95,
+        "avg": np.mean(sim_array, axis=0),
+    }
+
+    # Only the final year is needed outside the cache; don't store the whole matrix
+    final_balances = sim_array[:, -1].copy()
+
+    return final_balances, percentiles, df
+
+
+final_balances, percentiles, df = run_simulation(
+    initial_balance, annual_return, years, annual_contribution, volatility, simulations
+)
+p5, p10, p25, p50 = percentiles["p5"], percentiles["p10"], percentiles["p25"], percentiles["p50"]
+p75, p90, p95, avg = percentiles["p75"], percentiles["p90"], percentiles["p95"], percentiles["avg"]
+
+balance = df["Balance"].iloc[-1]
+total_invested = initial_balance + annual_contribution * years
+
+year_range = np.arange(1, years + 1)
+# Final-year statistics are the last column of the per-year percentiles
+final_p5, final_p25, final_median, final_p75, final_p95 = p5[-1], p25[-1], p50[-1], p75[-1], p95[-1]
+final_mean = avg[-1]
 
 # --- Summary Cards ---
 st.subheader("Summary — Base Case")
@@ -243,68 +260,84 @@ st.divider()
 st.subheader(f"Monte Carlo Simulation — {simulations} Scenarios")
 st.write("Shows the range of possible outcomes based on market volatility. The shaded bands represent where most simulations landed.")
 
-fig_mc = go.Figure()
-
-fig_mc.add_trace(go.Scatter(
-    x=year_range + year_range[::-1],
-    y=list(p90) + list(p10[::-1]),
-    fill="toself",
-    fillcolor="rgba(74, 144, 217, 0.15)",
-    line=dict(color="rgba(255,255,255,0)"),
-    name="10th–90th Percentile"
-))
-
-fig_mc.add_trace(go.Scatter(
-    x=year_range + year_range[::-1],
-    y=list(p75) + list(p25[::-1]),
-    fill="toself",
-    fillcolor="rgba(74, 144, 217, 0.30)",
-    line=dict(color="rgba(255,255,255,0)"),
-    name="25th–75th Percentile"
-))
-
-fig_mc.add_trace(go.Scatter(
-    x=year_range, y=p50,
-    mode="lines",
-    name="Median Outcome",
-    line=dict(color="#4A90D9", width=2, dash="dash")
-))
-
-fig_mc.add_trace(go.Scatter(
-    x=year_range, y=df["Balance"],
-    mode="lines",
-    name="Expected (Base Case)",
-    line=dict(color="#E74C3C", width=2)
-))
-
-fig_mc.update_layout(
-    xaxis_title="Year",
-    yaxis_title="Portfolio Value ($)",
-    yaxis_tickformat="$,.0f",
-    legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-    height=500,
-    plot_bgcolor="rgba(0,0,0,0)",
-    paper_bgcolor="rgba(0,0,0,0)",
-)
+# Figures are cached as shared resources keyed on the plotted arrays, so reruns with
+# unchanged results skip rebuilding them; they must not hold any per-session state.
+# Resources are process-wide, so bound them like the simulation cache.
+@st.cache_resource(max_entries=32)
+def build_mc_figure(year_range, p10, p25, p50, p75, p90, base_balances):
+    # Band polygons trace the upper percentile forward then the lower one back
+    x_band = np.concatenate([year_range, year_range[::-1]])
+
+    fig_mc = go.Figure()
+
+    fig_mc.add_trace(go.Scatter(
+        x=x_band,
+        y=np.concatenate([p90, p10[::-1]]),
+        fill="toself",
+        fillcolor="rgba(74, 144, 217, 0.15)",
+        line=dict(color="rgba(255,255,255,0)"),
+        name="10th–90th Percentile"
+    ))
 
+    fig_mc.add_trace(go.Scatter(
+        x=x_band,
+        y=np.concatenate([p75, p25[::-1]]),
+        fill="toself",
+        fillcolor="rgba(74, 144, 217, 0.30)",
+        line=dict(color="rgba(255,255,255,0)"),
+        name="25th–75th Percentile"
+    ))
+
+    fig_mc.add_trace(go.Scatter(
+        x=year_range, y=p50,
+        mode="lines",
+        name="Median Outcome",
+        line=dict(color="#4A90D9", width=2, dash="dash")
+    ))
+
+    fig_mc.add_trace(go.Scatter(
+        x=year_range, y=base_balances,
+        mode="lines",
+        name="Expected (Base Case)",
+        line=dict(color="#E74C3C", width=2)
+    ))
+
+    fig_mc.update_layout(
+        xaxis_title="Year",
+        yaxis_title="Portfolio Value ($)",
+        yaxis_tickformat="$,.0f",
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        height=500,
+        plot_bgcolor="rgba(0,0,0,0)",
+        paper_bgcolor="rgba(0,0,0,0)",
+    )
+
+    return fig_mc
+
+
+fig_mc = build_mc_figure(year_range, p10, p25, p50, p75, p90, df["Balance"].to_numpy())
 st.plotly_chart(fig_mc, use_container_width=True)
 
 # --- Outcome Distribution ---
 st.subheader("Distribution of Final Balances")
 col_a, col_b = st.columns([2, 1])
 
-with col_a:
+@st.cache_resource(max_entries=32)
+def build_hist_figure(final_balances, base_balance, final_median):
+    # Bin server-side so the browser only receives the 50 bar heights
+    hist_counts, hist_edges = np.histogram(final_balances, bins=50)
     fig_hist = go.Figure()
-    fig_hist.add_trace(go.Histogram(
-        x=final_balances,
-        nbinsx=50,
+    fig_hist.add_trace(go.Bar(
+        x=(hist_edges[:-1] + hist_edges[1:]) / 2,
+        y=hist_counts,
+        width=np.diff(hist_edges),
         marker_color="#4A90D9",
         opacity=0.75,
         name="Simulated Final Balances"
     ))
-    fig_hist.add_vline(x=balance, line_color="#E74C3C", line_width=2,
+    fig_hist.add_vline(x=base_balance, line_color="#E74C3C", line_width=2,
                        annotation_text="Base Case", annotation_position="top right")
-    fig_hist.add_vline(x=np.median(final_balances), line_color="#27AE60", line_width=2,
+    fig_hist.add_vline(x=final_median, line_color="#27AE60", line_width=2,
                        annotation_text="Median", annotation_position="top left")
     fig_hist.update_layout(
         xaxis_title="Final Balance ($)",
@@ -314,11 +347,16 @@ with col_a:
         plot_bgcolor="rgba(0,0,0,0)",
         paper_bgcolor="rgba(0,0,0,0)",
     )
+    return fig_hist
+
+
+with col_a:
+    fig_hist = build_hist_figure(final_balances, balance, final_median)
     st.plotly_chart(fig_hist, use_container_width=True)
 
 with col_b:
     st.subheader("Outcome Odds")
-    st.metric("Median Outcome", f"${np.median(final_balances):,.0f}")
+    st.metric("Median Outcome", f"${final_median:,.0f}")
     st.metric("Best Case (90th %)", f"${p90[-1]:,.0f}")
     st.metric("Worst Case (10th %)", f"${p10[-1]:,.0f}")
     prob_positive = np.mean(final_balances > total_invested) * 100
@@ -331,27 +369,33 @@ st.divider()
 # --- Stacked Bar Chart ---
 st.subheader("Your Money vs. Market Gains Over Time")
 
-fig_bar = go.Figure()
-fig_bar.add_trace(go.Bar(
-    x=df["Year"], y=df["Initial + Contributions"],
-    name="Your Money (Initial + Contributions)",
-    marker_color="#4A90D9"
-))
-fig_bar.add_trace(go.Bar(
-    x=df["Year"], y=df["Market Gains"],
-    name="Market Gains",
-    marker_color="#27AE60"
-))
-fig_bar.update_layout(
-    barmode="stack",
-    xaxis_title="Year",
-    yaxis_title="Portfolio Value ($)",
-    yaxis_tickformat="$,.0f",
-    legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-    height=400,
-    plot_bgcolor="rgba(0,0,0,0)",
-    paper_bgcolor="rgba(0,0,0,0)",
-)
+@st.cache_resource(max_entries=32)
+def build_bar_figure(year_range, invested, market_gains):
+    fig_bar = go.Figure()
+    fig_bar.add_trace(go.Bar(
+        x=year_range, y=invested,
+        name="Your Money (Initial + Contributions)",
+        marker_color="#4A90D9"
+    ))
+    fig_bar.add_trace(go.Bar(
+        x=year_range, y=market_gains,
+        name="Market Gains",
+        marker_color="#27AE60"
+    ))
+    fig_bar.update_layout(
+        barmode="stack",
+        xaxis_title="Year",
+        yaxis_title="Portfolio Value ($)",
+        yaxis_tickformat="$,.0f",
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        height=400,
+        plot_bgcolor="rgba(0,0,0,0)",
+        paper_bgcolor="rgba(0,0,0,0)",
+    )
+    return fig_bar
+
+
+fig_bar = build_bar_figure(year_range, df["Initial + Contributions"].to_numpy(), df["Market Gains"].to_numpy())
 st.plotly_chart(fig_bar, use_container_width=True)
 
 # --- Table ---
@@ -365,21 +409,20 @@ st.divider()
 st.subheader("Monte Carlo Percentile Table — Portfolio Balance by Year")
 st.write("Shows the range of simulated portfolio balances at each year across key percentiles and the average.")
 
-percentile_data = []
-for i, year in enumerate(year_range):
-    percentile_data.append({
-        "Year": year,
-        "5th Percentile": f"${p5[i]:,.0f}",
-        "25th Percentile": f"${p25[i]:,.0f}",
-        "50th Percentile (Median)": f"${p50[i]:,.0f}",
-        "Average": f"${avg[i]:,.0f}",
-        "75th Percentile": f"${p75[i]:,.0f}",
-        "95th Percentile": f"${p95[i]:,.0f}",
-        "Base Case": f"${df['Balance'].iloc[i]:,.0f}",
-    })
-
-df_percentiles = pd.DataFrame(percentile_data)
-st.dataframe(df_percentiles, use_container_width=True, hide_index=True)
+df_percentiles = pd.DataFrame({
+    "Year": year_range,
+    "5th Percentile": p5,
+    "25th Percentile": p25,
+    "50th Percentile (Median)": p50,
+    "Average": avg,
+    "75th Percentile": p75,
+    "95th Percentile": p95,
+    "Base Case": df["Balance"],
+})
+df_percentiles_style = df_percentiles.style.format(
+    {col: "${:,.0f}" for col in df_percentiles.columns if col != "Year"}
+)
+st.dataframe(df_percentiles_style, use_container_width=True, hide_index=True)
 
 st.divider()
 
@@ -387,14 +430,24 @@ st.divider()
 st.subheader("Overall Investment Period Summary")
 st.write("Summary statistics for the **final balance** across all simulations at the end of the full investment period.")
 
-overall_summary = pd.DataFrame([
-    {"Statistic": "5th Percentile (Worst Case)",      "Final Balance": f"${np.percentile(final_balances, 5):,.0f}",  "vs. Base Case": f"{((np.percentile(final_balances, 5) / balance) - 1) * 100:+.1f}%"},
-    {"Statistic": "25th Percentile (Below Average)",  "Final Balance": f"${np.percentile(final_balances, 25):,.0f}", "vs. Base Case": f"{((np.percentile(final_balances, 25) / balance) - 1) * 100:+.1f}%"},
-    {"Statistic": "50th Percentile (Median)",         "Final Balance": f"${np.median(final_balances):,.0f}",          "vs. Base Case": f"{((np.median(final_balances) / balance) - 1) * 100:+.1f}%"},
-    {"Statistic": "Average (Mean)",                   "Final Balance": f"${np.mean(final_balances):,.0f}",            "vs. Base Case": f"{((np.mean(final_balances) / balance) - 1) * 100:+.1f}%"},
-    {"Statistic": "75th Percentile (Above Average)",  "Final Balance": f"${np.percentile(final_balances, 75):,.0f}", "vs. Base Case": f"{((np.percentile(final_balances, 75) / balance) - 1) * 100:+.1f}%"},
-    {"Statistic": "95th Percentile (Best Case)",      "Final Balance": f"${np.percentile(final_balances, 95):,.0f}", "vs. Base Case": f"{((np.percentile(final_balances, 95) / balance) - 1) * 100:+.1f}%"},
-    {"Statistic": "Base Case (Expected)",             "Final Balance": f"${balance:,.0f}",                           "vs. Base Case": "—"},
-])
-
-st.dataframe(overall_summary, use_container_width=True, hide_index=True)
+final_stats = np.array([final_p5, final_p25, final_median, final_mean, final_p75, final_p95, balance])
+vs_base_case = (final_stats / balance - 1) * 100
+vs_base_case[-1] = np.nan  # the base case row is the reference itself
+overall_summary = pd.DataFrame({
+    "Statistic": [
+        "5th Percentile (Worst Case)",
+        "25th Percentile (Below Average)",
+        "50th Percentile (Median)",
+        "Average (Mean)",
+        "75th Percentile (Above Average)",
+        "95th Percentile (Best Case)",
+        "Base Case (Expected)",
+    ],
+    "Final Balance": final_stats,
+    "vs. Base Case": vs_base_case,
+})
+overall_summary_style = overall_summary.style.format(
+    {"Final Balance": "${:,.0f}", "vs. Base Case": "{:+.1f}%"}, na_rep="—"
+)
+
+st.dataframe(overall_summary_style, use_container_width=True, hide_index=True)
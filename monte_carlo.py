@@ -0,0 +1,28 @@
+import numpy as np
+
+
+def draw_growth_factors(rate, vol, years, simulations, seed=42):
+    """Seeded (simulations, years) float32 matrix of yearly growth factors 1 + r, r ~ Normal(rate, vol)."""
+    # float32 halves the memory the percentile/histogram passes have to scan, at a
+    # relative error of ~1e-6 (a few dollars per million) against float64 balances
+    # on the same draws -- not whole-dollar accuracy on large balances.
+    # Draw in place and turn the normals straight into yearly growth factors 1 + r.
+    factors = np.empty((simulations, years), dtype=np.float32)
+    np.random.default_rng(seed).standard_normal(dtype=np.float32, out=factors)
+    np.multiply(factors, vol, out=factors)
+    np.add(factors, 1.0 + rate, out=factors)
+    return factors
+
+
+def grow_balances(factors, initial_balance, annual_contribution):
+    """Simulated balance at the end of each year, one row per simulation."""
+    # Step all simulations forward a year at a time: balance = (balance + contribution) * (1 + r).
+    # Negative balances are floored to zero when recorded but carried forward unclipped.
+    simulations, years = factors.shape
+    sim_array = np.empty_like(factors)
+    sim_balance = np.full(simulations, initial_balance, dtype=factors.dtype)
+    for t in range(years):
+        sim_balance += annual_contribution
+        sim_balance *= factors[:, t]
+        np.maximum(sim_balance, 0.0, out=sim_array[:, t])
+    return sim_array
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from monte_carlo import draw_growth_factors, grow_balances
+
+
+def reference_balances(factors, initial_balance, annual_contribution):
+    # The original per-path, per-year loop, in float64
+    out = []
+    for path in factors.astype(np.float64):
+        sim_balance = initial_balance
+        sim_path = []
+        for factor in path:
+            sim_balance += annual_contribution
+            sim_balance *= factor
+            sim_path.append(max(sim_balance, 0))
+        out.append(sim_path)
+    return np.array(out)
+
+
+def test_matches_recurrence_with_zero_and_negative_factors():
+    factors = np.array([
+        [1.10, 0.00, 1.20, 1.05],   # growth wiped out in year 2, then rebuilt by contributions
+        [0.90, -0.10, 1.30, 1.00],  # balance goes negative and is carried forward unclipped
+        [1.07, 1.07, 1.07, 1.07],
+    ], dtype=np.float32)
+    result = grow_balances(factors, 10000.0, 2000.0)
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, reference_balances(factors, 10000.0, 2000.0), rtol=1e-6, atol=1e-3)
+
+
+@pytest.mark.parametrize("annual_return, volatility", [(22.06, 40), (0.96, 39), (2.87, 38), (7.0, 15)])
+def test_seeded_simulation_matches_recurrence(annual_return, volatility):
+    factors = draw_growth_factors(annual_return / 100, volatility / 100, 50, 2000)
+    result = grow_balances(factors, 10000.0, 2000.0)
+    assert np.isfinite(result).all()
+    expected = reference_balances(factors, 10000.0, 2000.0)
+    np.testing.assert_allclose(
+        np.percentile(result, [5, 50, 95], axis=0), np.percentile(expected, [5, 50, 95], axis=0), rtol=1e-5
+    )